@@ -1,13 +1,30 @@
 import os
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+from werkzeug.local import LocalProxy
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv 
 from data.dummy_data import products
-from utils.wishlist import add_to_wishlist_helper, remove_from_wishlist_helper, get_wishlist_items
-from utils.cart import add_to_cart, remove_from_cart, get_cart_items, update_quantity
-from utils.products import get_product
+from utils.wishlist import (
+    add_to_wishlist_helper, remove_from_wishlist_helper, get_wishlist_items,
+    save_wishlist, get_wishlist_count,
+)
+from utils.cart import (
+    add_to_cart, remove_from_cart as remove_from_cart_helper, get_cart_items, update_quantity, save_cart, get_cart_count,
+)
+from utils.products import get_product, get_recent_sales, PERIOD_DAYS
+from utils.ratelimit import rate_limit, set_store, SqliteBucketStore
+from utils.stock import (
+    get_holder, reserve_for_session, reserve_cart, release, decrement_for_order, start_sweeper,
+    OutOfStock, DEFAULT_STOCK, MAX_RESERVE_PER_ITEM,
+)
+from utils.jobs import enqueue, queue_stats
+from utils.templates import setup_template_cache, precompile_templates, stream_page
+from utils.compression import compress_response
+from utils.shards import OrderShards
 
 
 load_dotenv()
@@ -15,10 +32,49 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')
 
+# number of proxies in front of the app whose X-Forwarded-For can be trusted.
+# Only set it when there really is one (the Procfile does for the platform
+# router), otherwise any client could pick its own IP for the rate limiter
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+DEBUG = os.getenv("FLASK_DEBUG") == "1"
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", os.path.join(app.root_path, ".jinja_cache"))
+
+# only watch templates for changes while developing, production compiles
+# them up front in gunicorn.conf.py
+app.config["TEMPLATES_AUTO_RELOAD"] = DEBUG
+setup_template_cache(app, TEMPLATE_CACHE_DIR)
+
+
+@app.cli.command("precompile-templates")
+def precompile_templates_command():
+    """Fill the template bytecode cache, run this as a build step."""
+    count = precompile_templates(app)
+    click.echo(f"Compiled {count} templates into {TEMPLATE_CACHE_DIR}")
+
+
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
+# users get their own file, and stored orders are split over ORDER_SHARDS
+# files by id. That spreads order storage and the admin reads over several
+# files, it does not take writes off DB_NAME: every checkout still writes
+# its stock, outbox row and jobs there under one lock
+_db_root, _db_ext = os.path.splitext(DB_NAME)
+USERS_DB_NAME = os.getenv("USERS_DB_NAME", f"{_db_root}_users{_db_ext}")
+ORDER_SHARDS = int(os.getenv("ORDER_SHARDS", 4))
+order_shards = OrderShards(f"{_db_root}_orders_{i}{_db_ext}" for i in range(ORDER_SHARDS))
+
+# "sqlite" shares rate limit buckets across gunicorn workers through their
+# own file, kept apart from DB_NAME so limiter writes never wait on checkout's
+# lock. Otherwise each worker keeps its buckets in memory
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", f"{_db_root}_ratelimit{_db_ext}")
+if os.getenv("RATE_LIMIT_BACKEND") == "sqlite":
+    set_store(SqliteBucketStore(RATE_LIMIT_DB))
+
 
 def login_required(f):
     @wraps(f)
@@ -31,20 +87,35 @@ def login_required(f):
 
 @app.context_processor
 def inject_user():
+    # cart and wishlist are proxies, only read from the session if a
+    # template actually uses them
     return dict(
         username=session.get("username"),
         is_admin=session.get("role") == "admin",
-        cart=session.get("cart", {}),
-        wishlist=session.get("wishlist", {})
+        cart=LocalProxy(lambda: session.get("cart", {})),
+        wishlist=LocalProxy(lambda: session.get("wishlist", {})),
+        cart_count=LocalProxy(get_cart_count),
+        wishlist_count=LocalProxy(get_wishlist_count),
     )
 
+@app.after_request
+def compress(response):
+    return compress_response(response)
+
 # -------- DATABASE CONNECTION --------
 def get_db_connection():
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row 
     return conn
 
-with get_db_connection() as conn:
+def get_users_connection():
+    conn = sqlite3.connect(USERS_DB_NAME, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+with get_users_connection() as conn:
+    conn.execute("PRAGMA journal_mode=WAL")
+
     # Create users table
     conn.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -55,9 +126,18 @@ with get_db_connection() as conn:
         )
     """)
 
-    # Create orders table
+# Create orders tables, one per shard
+order_shards.create_schema()
+
+with get_db_connection() as conn:
+    # WAL lets the web workers and the job worker read while one of them writes
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    # Create order outbox: checkout saves orders here in the same transaction
+    # as the stock decrement, the store_order job then moves them to their
+    # shard. Its AUTOINCREMENT hands out every order id.
     conn.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
+        CREATE TABLE IF NOT EXISTS order_outbox (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             first_name TEXT NOT NULL,
             last_name TEXT NOT NULL,
@@ -71,9 +151,118 @@ with get_db_connection() as conn:
         )
     """)
 
+    # Create stock tables, reservations hold items while they sit in a cart
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock (
+            product_id INTEGER PRIMARY KEY,
+            quantity INTEGER NOT NULL CHECK (quantity >= 0)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            holder TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (holder, product_id)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reservations_product ON stock_reservations (product_id, expires_at)"
+    )
+    # Create job queue, see utils/jobs.py and worker.py
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            run_at REAL NOT NULL,
+            locked_until REAL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at)")
+
+    # Create sales counters, one row per product per order so replays are no-ops
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS product_sales (
+            product_id INTEGER NOT NULL,
+            order_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (product_id, order_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_created ON product_sales (created_at)")
+
+    # Create analytics rollup, one row per day, filled by the record_analytics job
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            day TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL,
+            revenue REAL NOT NULL
+        )
+    """)
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO stock (product_id, quantity) VALUES (?, ?)",
+        [(p["id"], p.get("stock", DEFAULT_STOCK)) for p in products],
+    )
+
     conn.commit()
 
 
+
+def migrate_legacy_tables():
+    """Move users and orders that still live in DB_NAME to their own files, once.
+
+    Runs under DB_NAME's write lock so workers booting together can't both
+    copy. Copies are INSERT OR IGNORE, so an interrupted run is just redone.
+    """
+    conn = get_db_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        if "users" in tables:
+            users = conn.execute("SELECT id, username, email, password FROM users").fetchall()
+            with get_users_connection() as users_conn:
+                users_conn.executemany(
+                    "INSERT OR IGNORE INTO users (id, username, email, password) VALUES (?, ?, ?, ?)",
+                    users,
+                )
+            users_conn.close()
+            conn.execute("ALTER TABLE users RENAME TO legacy_users")
+
+        if "orders" in tables:
+            orders = [dict(row) for row in conn.execute("SELECT * FROM orders")]
+            order_shards.store(orders)
+            # new ids must carry on after the migrated ones
+            last_id = max((order["id"] for order in orders), default=0)
+            seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'order_outbox'").fetchone()
+            if seq is None:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('order_outbox', ?)", (last_id,))
+            elif seq[0] < last_id:
+                conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'order_outbox'", (last_id,))
+            conn.execute("ALTER TABLE orders RENAME TO legacy_orders")
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+migrate_legacy_tables()
+start_sweeper(get_db_connection)
+
+
  
 
 # -------- ROUTES --------
@@ -105,7 +294,7 @@ def categories():
     else:
         filtered_products = [p for p in products if selected_category in p.get("tags", [])]
 
-    return render_template(
+    return stream_page(
         "pages/categories.html",
         categories=categories,
         products=filtered_products,
@@ -123,14 +312,24 @@ def best_selling():
     # default filter is last30
     period = request.args.get("period", "last30")
 
+    # add live orders (recorded by the update_sales job) to the seeded figures
+    conn = get_db_connection()
+    live_sales = get_recent_sales(conn, PERIOD_DAYS.get(period, 30))
+    conn.close()
+    ranked = []
+    for p in products:
+        p = dict(p, sold=dict(p["sold"]))
+        p["sold"][period] += live_sales.get(p["id"], 0)
+        ranked.append(p)
+
     # sort/filter products by the chosen period
     sorted_products = sorted(
-        products,
+        ranked,
         key=lambda p: p["sold"][period],
         reverse=True  # highest sold first
     )
 
-    return render_template(
+    return stream_page(
         "pages/best_selling.html",
         products=sorted_products,
         period=period
@@ -178,7 +377,21 @@ def cart():
 
 
 @app.route("/add_to_cart/<int:product_id>")
+@rate_limit(30, 60)
 def add(product_id):
+    quantity = session.get("cart", {}).get(str(product_id), 0) + 1
+    if quantity > MAX_RESERVE_PER_ITEM:
+        flash(f"You can only have {MAX_RESERVE_PER_ITEM} of an item in your cart.", "warning")
+        return redirect(request.referrer or url_for('home'))
+    conn = get_db_connection()
+    try:
+        reserved = reserve_for_session(conn, product_id, quantity)
+    finally:
+        conn.close()
+    if not reserved:
+        flash("Sorry, that item is out of stock.", "danger")
+        return redirect(request.referrer or url_for('home'))
+
     add_to_cart(product_id)
     flash("Item added to cart", "success")
     return redirect(request.referrer or url_for('home'))
@@ -186,38 +399,60 @@ def add(product_id):
 
 @app.route("/remove_from_cart/<int:product_id>")
 def remove(product_id):
-    remove_from_cart(product_id)
+    remove_from_cart_helper(product_id)
+    conn = get_db_connection()
+    release(conn, get_holder(), product_id)
+    conn.close()
     flash("Item removed from cart", "info")
     return redirect(request.referrer or url_for('home'))
 
-@app.route('/update_cart/<product_id>', methods=["POST"])
+@app.route('/update_cart/<int:product_id>', methods=["POST"])
+@rate_limit(30, 60)
 def update_cart(product_id):
     qty = int(request.form.get("quantity", 1))
+    if qty > MAX_RESERVE_PER_ITEM:
+        flash(f"You can only have {MAX_RESERVE_PER_ITEM} of an item in your cart.", "warning")
+        qty = MAX_RESERVE_PER_ITEM
     cart = session.get("cart", {})
-    product_id = str(product_id)
 
+    conn = get_db_connection()
+    try:
+        reserved = reserve_for_session(conn, product_id, qty)
+    finally:
+        conn.close()
+    if not reserved:
+        flash("Sorry, there isn't enough stock for that quantity.", "danger")
+        return redirect(url_for("cart"))
+
+    product_id = str(product_id)
     if qty > 0:
         cart[product_id] = qty
     else:
         cart.pop(product_id, None)
-    session["cart"] = cart
+    save_cart(cart)
     return redirect(url_for("cart"))
 
-@app.route('/remove_from_cart/<product_id>', methods=["POST"])
+@app.route('/remove_from_cart/<int:product_id>', methods=["POST"])
 def remove_from_cart(product_id):
-    cart = session.get("cart", {})
-    product_id = str(product_id)
+    remove_from_cart_helper(product_id)
 
-    if product_id in cart:
-        del cart[product_id]
-    session["cart"] = cart
+    conn = get_db_connection()
+    release(conn, get_holder(), product_id)
+    conn.close()
 
     return redirect(url_for("cart"))
 
 
 @app.route("/update_quantity/<int:product_id>", methods=["POST"])
 def update_quantity_route(product_id):
-    quantity = int(request.form.get("quantity", 1))
+    quantity = min(int(request.form.get("quantity", 1)), MAX_RESERVE_PER_ITEM)
+    conn = get_db_connection()
+    try:
+        reserved = reserve_for_session(conn, product_id, quantity)
+    finally:
+        conn.close()
+    if not reserved:
+        return jsonify(success=False, cart=session.get("cart", {}))
     update_quantity(product_id, quantity)
     return jsonify(success=True, cart=session.get("cart", {}))
 
@@ -240,20 +475,47 @@ def checkout():
         zipcode = request.form.get("postcode")
         payment_method = request.form.get("payment")  # <-- must exist in your form
 
-        # ✅ Save order into DB
-        with get_db_connection() as conn:
-            conn.execute(
+        # ✅ Save order and take its items out of stock in one transaction
+        conn = get_db_connection()
+        try:
+            cart = session.get("cart", {})
+            decrement_for_order(conn, get_holder(), cart)
+            order_id = conn.execute(
                 """
-                INSERT INTO orders (
+                INSERT INTO order_outbox (
                     first_name, last_name, email, address, city, state, zipcode, total_amount
                 ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (first_name, last_name, email, address, city, state, zipcode, total),
-            )
+            ).lastrowid
+            created_at = conn.execute(
+                "SELECT created_at FROM order_outbox WHERE id = ?", (order_id,)
+            ).fetchone()[0]
+
+            # the shard write and other side effects run in worker.py once
+            # the order is committed
+            enqueue(conn, "store_order", {"order_id": order_id},
+                    key=f"store_order:{order_id}")
+            enqueue(conn, "update_sales", {"order_id": order_id, "cart": cart},
+                    key=f"update_sales:{order_id}")
+            enqueue(conn, "record_analytics",
+                    {"order_id": order_id, "total": total, "created_at": created_at},
+                    key=f"record_analytics:{order_id}")
+            if payment_method == "pod":
+                enqueue(conn, "send_confirmation", {"order_id": order_id},
+                        key=f"send_confirmation:{order_id}")
             conn.commit()
+        except OutOfStock as e:
+            conn.rollback()
+            names = ", ".join(p["name"] for p in products if p["id"] in e.product_ids)
+            flash(f"Sorry, not enough stock left for: {names}", "danger")
+            return redirect(url_for("cart"))
+        finally:
+            conn.close()
 
         # ✅ Clear cart after saving
-        session["cart"] = {}
+        save_cart({})
+        session["last_order_id"] = order_id
 
         # ✅ handle redirection depending on payment
         if payment_method == "pod":
@@ -264,6 +526,16 @@ def checkout():
             # Bank Payment → fake gateway simulation page
             return redirect(url_for("pay_gateway"))
 
+    # hold everything in the cart while the user fills in the form
+    conn = get_db_connection()
+    try:
+        unavailable = reserve_cart(conn, get_holder(), session.get("cart", {}))
+    finally:
+        conn.close()
+    if unavailable:
+        names = ", ".join(p["name"] for p in products if str(p["id"]) in unavailable)
+        flash(f"Some items are no longer available: {names}", "danger")
+
     return render_template(
         "pages/checkout.html",
         cart_items=cart_items_with_details,
@@ -279,11 +551,18 @@ def order_confirmation():
     return render_template("pages/order_confirmation.html")
 
 @app.route("/pay-gateway", methods=["GET", "POST"])
+@rate_limit(5, 60, methods=["POST"])
 def pay_gateway():
     if request.method == "POST":
         # fake verification logic
         card_number = request.form.get("card_number")
         if card_number and card_number.startswith("4"):  # e.g., "Visa starts with 4"
+            order_id = session.get("last_order_id")
+            if order_id:
+                with get_db_connection() as conn:
+                    enqueue(conn, "send_confirmation", {"order_id": order_id},
+                            key=f"send_confirmation:{order_id}")
+                    conn.commit()
             flash("Payment successful!", "success")
             return redirect(url_for("order_confirmation"))
         else:
@@ -329,6 +608,7 @@ def about():
 #------------ AUTH ------------
 
 @app.route("/login", methods=["GET", "POST"])
+@rate_limit(10, 60, methods=["POST"])
 def login():
     if request.method == "POST":
         email = request.form.get("email", "").strip()
@@ -345,7 +625,7 @@ def login():
             flash("Username and password are required.", "danger")
             return redirect(url_for("login"))
 
-        conn = get_db_connection()
+        conn = get_users_connection()
         user = conn.execute(
             "SELECT * FROM users WHERE email = ?",
             (email,)
@@ -355,6 +635,7 @@ def login():
         if user and check_password_hash(user["password"], password):
             guest_cart = session.get("cart", {})
             guest_wishlist = session.get("wishlist", {})
+            cart_id = session.get("cart_id")
 
             session.clear()
             session["user_id"] = user["id"]
@@ -362,9 +643,11 @@ def login():
             session["is_admin"] = False
 
             if guest_cart:
-                session["cart"] = guest_cart
+                save_cart(guest_cart)
+            if cart_id:
+                session["cart_id"] = cart_id
             if guest_wishlist:
-                session["wishlist"] = guest_wishlist
+                save_wishlist(guest_wishlist)
             flash("Login successful!", "success")
             return redirect(url_for("home"))
 
@@ -376,6 +659,7 @@ def login():
 
 
 @app.route("/register", methods=['GET', 'POST'])
+@rate_limit(5, 300, methods=["POST"])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -390,7 +674,7 @@ def register():
         
         hashed_password = generate_password_hash(password)
 
-        conn = get_db_connection()
+        conn = get_users_connection()
         try:
             conn.execute('INSERT INTO users (email, username, password) VALUES (?, ?, ?)',
                          (email, username, hashed_password))
@@ -409,6 +693,11 @@ def register():
 
 @app.route("/logout")
 def logout():
+    if "cart_id" in session:
+        # give the cart's stock back now rather than after RESERVATION_TTL
+        conn = get_db_connection()
+        release(conn, session["cart_id"])
+        conn.close()
     session.clear()
     flash("You have been logged out.", "info")
     return redirect(url_for("home"))
@@ -428,16 +717,38 @@ def admin_required(f):
 @app.route("/admin/dashboard")
 @admin_required
 def admin_dashboard():
-    conn = get_db_connection()
+    conn = get_users_connection()
     users = conn.execute("SELECT id, username, email, password FROM users").fetchall()
     conn.close()
-    return render_template("admin/dashboard.html", users=users)
+    conn = get_db_connection()
+    daily_sales = conn.execute(
+        "SELECT day, orders, revenue FROM daily_sales ORDER BY day DESC LIMIT 14"
+    ).fetchall()
+    # orders the worker hasn't moved to their shard yet
+    pending = [dict(row) for row in conn.execute("SELECT * FROM order_outbox")]
+    conn.close()
+
+    orders = sorted(
+        pending + order_shards.recent(50),
+        key=lambda o: (o["created_at"], o["id"]),
+        reverse=True,
+    )[:50]
+    order_totals = order_shards.totals()
+    order_totals["count"] += len(pending)
+    order_totals["revenue"] += sum(o["total_amount"] for o in pending)
+    return render_template(
+        "admin/dashboard.html",
+        users=users,
+        daily_sales=daily_sales,
+        orders=orders,
+        order_totals=order_totals,
+    )
 
 
 @app.route("/admin/delete_user/<int:user_id>", methods=["POST", "GET"])
 @admin_required
 def delete_user(user_id):
-    conn = get_db_connection()
+    conn = get_users_connection()
     conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
     conn.commit()
     conn.close()
@@ -445,6 +756,15 @@ def delete_user(user_id):
     return redirect(url_for("admin_dashboard"))
 
 
+@app.route("/admin/metrics/jobs")
+@admin_required
+def job_metrics():
+    conn = get_db_connection()
+    stats = queue_stats(conn)
+    conn.close()
+    return jsonify(stats)
+
+
 @app.route("/admin/add_product")
 def add_product():
     return render_template("admin/add_product.html")
@@ -0,0 +1,133 @@
+"""Concurrent checkout stress test: many processes race to buy limited stock.
+
+Drives POST /checkout through the Flask test client against a throwaway
+database and checks that nothing was oversold. With --workers, job workers
+run alongside and the time until every order reaches its shard is reported.
+
+Every checkout takes DB_NAME's write lock whatever --shards is, so don't
+expect throughput to grow with the shard count. Order sharding spreads
+storage and reads, not checkout writes.
+
+    python bench/checkout_stress.py --procs 16 --orders 40 --stock 300
+    python bench/checkout_stress.py --shards 4 --workers 2 --stock 100000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+CART = {"1": 1, "2": 2}
+FORM = dict(
+    first_name="Stress", last_name="Test", address="1 Main St", city="Lagos",
+    state="LA", postcode="100001", payment="pod",
+)
+
+
+def buyer(worker, orders, results):
+    import app
+
+    client = app.app.test_client()
+    placed = sold_out = errors = 0
+    for n in range(orders):
+        with client.session_transaction() as session:
+            session["user_id"] = worker
+            session["username"] = f"buyer{worker}"
+            session["cart_id"] = f"cart-{worker}-{n}"
+            session["cart"] = dict(CART)
+        response = client.post("/checkout", data=dict(FORM, email=f"buyer{worker}-{n}@example.com"))
+        location = response.headers.get("Location", "")
+        if response.status_code == 302 and location.endswith("/order-confirmation"):
+            placed += 1
+        elif response.status_code == 302 and location.endswith("/cart"):
+            sold_out += 1
+        else:
+            errors += 1
+    results.put((placed, sold_out, errors))
+
+
+def job_worker():
+    import app
+    from utils.jobs import run_worker
+    import worker  # noqa: F401, registers the handlers
+
+    run_worker(app.get_db_connection, poll_interval=0.05)
+
+
+def outstanding_jobs(app):
+    with app.get_db_connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM jobs WHERE status != 'done'").fetchone()[0]
+    conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--procs", type=int, default=16)
+    parser.add_argument("--orders", type=int, default=40, help="checkouts per process")
+    parser.add_argument("--stock", type=int, default=300, help="starting stock of each product")
+    parser.add_argument("--shards", type=int, default=4, help="ORDER_SHARDS")
+    parser.add_argument("--workers", type=int, default=0, help="job worker processes")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(tmp, "stress.db")
+    os.environ["ORDER_SHARDS"] = str(args.shards)
+    os.environ.setdefault("SECRET_KEY", "stress")
+    import app
+
+    with app.get_db_connection() as conn:
+        conn.execute("UPDATE stock SET quantity = ?", (args.stock,))
+        conn.commit()
+    conn.close()
+
+    workers = [multiprocessing.Process(target=job_worker, daemon=True) for _ in range(args.workers)]
+    for w in workers:
+        w.start()
+
+    results = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=buyer, args=(i, args.orders, results))
+        for i in range(args.procs)
+    ]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    totals = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+    placed, sold_out, errors = (sum(column) for column in zip(*totals))
+    print(f"{placed} placed, {sold_out} sold out, {errors} errors in {elapsed:.2f}s "
+          f"({(placed + sold_out) / elapsed:.0f} checkouts/s)")
+
+    if workers:
+        while outstanding_jobs(app):
+            time.sleep(0.05)
+        drained = time.perf_counter() - start
+        print(f"all jobs done after {drained:.2f}s ({placed / drained:.0f} orders/s end to end)")
+        for w in workers:
+            w.terminate()
+
+    with app.get_db_connection() as conn:
+        left = dict(conn.execute("SELECT product_id, quantity FROM stock WHERE product_id IN (1, 2)"))
+        pending = conn.execute("SELECT COUNT(*) FROM order_outbox").fetchone()[0]
+    conn.close()
+    orders_saved = app.order_shards.totals()["count"] + pending
+    print(f"stock left: {left}, orders saved: {orders_saved}")
+
+    oversold = any(
+        args.stock - left[int(pid)] != placed * qty or left[int(pid)] < 0
+        for pid, qty in CART.items()
+    )
+    if oversold or orders_saved != placed or errors:
+        print("FAIL: stock and orders don't add up")
+        sys.exit(1)
+    print("OK: no oversells")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Transfer size and time to first byte of /best-selling on a large synthetic catalog.
+
+    python bench/listing_transfer.py --products 5000
+"""
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(tmp, "bench.db")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    import app
+    from flask import render_template
+    from utils import compression
+
+    seed = list(app.products)
+    for i in range(args.products - len(seed)):
+        product = copy.deepcopy(seed[i % len(seed)])
+        product["id"] = 1000 + i
+        app.products.append(product)
+
+    with app.app.test_request_context("/best-selling"):
+        start = time.perf_counter()
+        html = render_template("pages/best_selling.html", products=app.products, period="last30")
+        buffered = time.perf_counter() - start
+    print(f"{len(app.products)} products")
+    print(f"{'buffered render':<16} ttfb {buffered * 1e3:8.2f}ms  size {len(html.encode()):>9} B")
+
+    client = app.app.test_client()
+    client.get("/best-selling")  # warm up
+    encodings = ["identity", "gzip"] + (["br"] if compression.brotli else [])
+    for encoding in encodings:
+        start = time.perf_counter()
+        response = client.get("/best-selling", headers={"Accept-Encoding": encoding}, buffered=False)
+        chunks = iter(response.response)
+        first = next(chunks)
+        ttfb = time.perf_counter() - start
+        size = len(first) + sum(len(chunk) for chunk in chunks)
+        total = time.perf_counter() - start
+        print(f"{'streamed ' + encoding:<16} ttfb {ttfb * 1e3:8.2f}ms  size {size:>9} B  total {total * 1e3:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
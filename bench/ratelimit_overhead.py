@@ -0,0 +1,57 @@
+"""Per-request overhead of @rate_limit, for each bucket store.
+
+    python bench/ratelimit_overhead.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask
+from utils import ratelimit
+from utils.ratelimit import rate_limit, MemoryBucketStore, SqliteBucketStore
+
+REQUESTS = 2000
+
+app = Flask(__name__)
+app.secret_key = "bench"
+
+
+@app.route("/plain")
+def plain():
+    return "ok"
+
+
+@app.route("/limited")
+@rate_limit(10 ** 9, 60)
+def limited():
+    return "ok"
+
+
+def per_request(client, path):
+    client.get(path)  # warm up
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        client.get(path)
+    return (time.perf_counter() - start) / REQUESTS * 1e6
+
+
+def main():
+    client = app.test_client()
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = [
+            ("memory", MemoryBucketStore()),
+            ("sqlite", SqliteBucketStore(os.path.join(tmp, "bench.db"))),
+        ]
+        base = per_request(client, "/plain")
+        print(f"no limiter       {base:8.1f} us/request")
+        for name, store in stores:
+            ratelimit.set_store(store)
+            cost = per_request(client, "/limited")
+            print(f"{name:<16} {cost:8.1f} us/request  (+{cost - base:.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
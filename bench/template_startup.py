@@ -0,0 +1,71 @@
+"""First-request latency per route in a fresh process, cold versus warm.
+
+cold:       templates compile lazily on first hit (no precompile, empty cache)
+precompile: precompile_templates() runs at worker start with an empty cache
+warm:       precompile_templates() loads from a filled bytecode cache
+
+    python bench/template_startup.py
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ROUTES = ["/", "/about", "/categories", "/best-selling", "/product/1", "/contact-us", "/login", "/register"]
+
+
+def measure(precompile):
+    """Runs in the child process, prints timings as JSON."""
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    import app
+    from utils.templates import precompile_templates
+
+    if precompile:
+        precompile_templates(app.app)
+    timings = {"startup": time.perf_counter() - start}
+    client = app.app.test_client()
+    for route in ROUTES:
+        start = time.perf_counter()
+        client.get(route)
+        timings[route] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+
+def run(env, precompile):
+    out = subprocess.check_output(
+        [sys.executable, __file__, "--child", "1" if precompile else "0"], env=env, cwd=ROOT
+    )
+    return json.loads(out)
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    cache = os.path.join(tmp, "jinja_cache")
+    env = dict(
+        os.environ, DB_NAME=os.path.join(tmp, "bench.db"), SECRET_KEY="bench",
+        TEMPLATE_CACHE_DIR=cache,
+    )
+    run(env, False)  # create the database files outside the timings
+    shutil.rmtree(cache)
+
+    cold = run(env, False)
+    shutil.rmtree(cache)
+    precompiled = run(env, True)
+    warm = run(env, True)
+
+    print(f"{'':<14} {'cold':>9} {'precompile':>11} {'warm':>9}   (ms)")
+    for key in cold:
+        print(f"{key:<14} {cold[key] * 1e3:9.2f} {precompiled[key] * 1e3:11.2f} {warm[key] * 1e3:9.2f}")
+    shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        measure(sys.argv[2] == "1")
+    else:
+        main()
@@ -1,27 +0,0 @@
-import sqlite3
-from flask import flash
-
-
-conn = sqlite3.connect('orders.db')
-cursor = conn.cursor()
-
-
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        first_name TEXT NOT NULL,
-        last_name TEXT NOT NULL,
-        email TEXT NOT NULL,
-        phone TEXT NOT NULL,
-        address TEXT NOT NULL,
-        city TEXT NOT NULL,
-        state TEXT NOT NULL,
-        postcode TEXT NOT NULL,
-        total_amount REAL NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    );
-''')
-
-conn.commit()
-conn.close()
- 
\ No newline at end of file
@@ -0,0 +1,12 @@
+# Picked up automatically by `gunicorn app:app` (see Procfile).
+
+
+def post_worker_init(worker):
+    # compile every template before this worker takes its first request,
+    # loading from the shared bytecode cache when a build step filled it
+    from app import app, DEBUG
+    from utils.templates import precompile_templates
+
+    if not DEBUG:
+        count = precompile_templates(app)
+        worker.log.info("Precompiled %d templates", count)
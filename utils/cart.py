@@ -1,11 +1,21 @@
 from flask import session
 from data.dummy_data import products
 
+def save_cart(cart):
+    """Store the cart with its item count, so the navbar badge needn't add it up."""
+    session["cart"] = cart
+    session["cart_count"] = sum(cart.values())
+
+def get_cart_count():
+    if "cart_count" not in session:
+        return sum(session.get("cart", {}).values())
+    return session["cart_count"]
+
 def add_to_cart(product_id):
     cart = session.get("cart", {})
     product_id = str(product_id) #keys must be strings
     cart[product_id] = cart.get(product_id, 0) + 1
-    session["cart"] = cart
+    save_cart(cart)
 
 def remove_from_cart(product_id):
     cart = session.get("cart", {})
@@ -13,7 +23,7 @@ def remove_from_cart(product_id):
 
     if product_id in cart:
         del cart[product_id]
-    session["cart"] = cart
+    save_cart(cart)
 
 def update_quantity(product_id, quantity):
     cart = session.get("cart", {})
@@ -22,7 +32,7 @@ def update_quantity(product_id, quantity):
         cart[product_id] = quantity
     else:
         cart.pop(product_id, None)
-    session["cart"] = cart
+    save_cart(cart)
 
 
 
@@ -0,0 +1,169 @@
+import json
+import logging
+import sqlite3
+import time
+
+MAX_ATTEMPTS = 5
+MAX_IDLE_BACKOFF = 30  # seconds, longest the worker sleeps after a locked database
+BACKOFF_BASE = 2  # seconds, doubled on every retry
+LEASE = 5 * 60  # a running job not finished by then is assumed dead and retried
+RETENTION = 7 * 24 * 3600  # seconds a done job is kept before it is deleted
+PURGE_INTERVAL = 10 * 60  # seconds between purges of old done jobs
+
+log = logging.getLogger(__name__)
+
+handlers = {}
+
+
+def job(name):
+    """Register a handler for jobs called `name`.
+
+    Handlers get the worker's connection and should not commit: their writes
+    commit together with the job being marked done. Anything outside the
+    database (emails etc.) may still run twice, so keep those idempotent.
+    """
+    def decorator(f):
+        handlers[name] = f
+        return f
+    return decorator
+
+
+def enqueue(conn, name, payload, key=None):
+    """Queue a job on the caller's connection, so it commits with their transaction.
+
+    `key` makes the enqueue idempotent: a second job with the same key is dropped.
+    """
+    now = time.time()
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO jobs (name, payload, key, run_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (name, json.dumps(payload), key, now, now),
+    )
+
+
+def claim(conn):
+    """Lease the next due job to this worker, or return None."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """
+            SELECT * FROM jobs
+            WHERE (status = 'queued' AND run_at <= ?)
+               OR (status = 'running' AND locked_until <= ?)
+            ORDER BY run_at LIMIT 1
+            """,
+            (now, now),
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                                started_at = ?, locked_until = ?
+                WHERE id = ?
+                """,
+                (now, now + LEASE, row["id"]),
+            )
+        conn.commit()
+        return row
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def run_job(conn, row):
+    attempts = row["attempts"] + 1
+    try:
+        handler = handlers[row["name"]]
+        handler(conn, **json.loads(row["payload"]))
+    except Exception as e:
+        conn.rollback()
+        if attempts >= MAX_ATTEMPTS:
+            log.exception("Job %s (%s) failed for good", row["id"], row["name"])
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', last_error = ?, finished_at = ? WHERE id = ?",
+                (repr(e), time.time(), row["id"]),
+            )
+        else:
+            log.warning("Job %s (%s) failed, retrying: %r", row["id"], row["name"], e)
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', last_error = ?, run_at = ? WHERE id = ?",
+                (repr(e), time.time() + BACKOFF_BASE ** attempts, row["id"]),
+            )
+    else:
+        conn.execute(
+            "UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ?",
+            (time.time(), row["id"]),
+        )
+    conn.commit()
+
+
+def purge_done(conn, older_than=RETENTION):
+    """Delete jobs that finished more than `older_than` seconds ago. Failed jobs are kept."""
+    cur = conn.execute(
+        "DELETE FROM jobs WHERE status = 'done' AND finished_at < ?", (time.time() - older_than,)
+    )
+    conn.commit()
+    return cur.rowcount
+
+
+def run_worker(connect, poll_interval=1.0):
+    """Claim and run jobs forever, sleeping while the queue is empty.
+
+    A locked or busy database only pauses the worker. A job whose status
+    could not be saved keeps its lease and is picked up again when the
+    lease runs out. Old done jobs are purged while the queue is idle.
+    """
+    conn = connect()
+    backoff = poll_interval
+    next_purge = 0
+    while True:
+        try:
+            row = claim(conn)
+            if row is not None:
+                run_job(conn, row)
+            elif time.time() >= next_purge:
+                purge_done(conn)
+                next_purge = time.time() + PURGE_INTERVAL
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            log.warning("Database unavailable, retrying in %.0fs: %s", backoff, e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_IDLE_BACKOFF)
+            continue
+
+        backoff = poll_interval
+        if row is None:
+            time.sleep(poll_interval)
+
+
+def queue_stats(conn, window=3600):
+    """Queue depth by status and latency of jobs finished in the last `window` seconds."""
+    now = time.time()
+    depth = {status: 0 for status in ("queued", "running", "done", "failed")}
+    for status, count in conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+        depth[status] = count
+
+    oldest = conn.execute(
+        "SELECT MIN(created_at) FROM jobs WHERE status = 'queued' AND run_at <= ?", (now,)
+    ).fetchone()[0]
+    latency = conn.execute(
+        """
+        SELECT COUNT(*), AVG(started_at - created_at), AVG(finished_at - created_at),
+               MAX(finished_at - created_at)
+        FROM jobs WHERE status = 'done' AND finished_at >= ?
+        """,
+        (now - window,),
+    ).fetchone()
+
+    return {
+        "depth": depth,
+        "oldest_queued_age": now - oldest if oldest else 0,
+        "finished": latency[0],
+        "avg_wait": latency[1] or 0,
+        "avg_latency": latency[2] or 0,
+        "max_latency": latency[3] or 0,
+    }
@@ -1,6 +1,21 @@
 
 from data.dummy_data import products
 
+PERIOD_DAYS = {"last7": 7, "last14": 14, "last30": 30}
+
 def get_product(product_id):
     """Fetch a single product by its ID from dummy data."""
     return next((p for p in products if p["id"] == product_id), None)
+
+
+def get_recent_sales(conn, days):
+    """Units sold per product id over the last `days` days, from product_sales."""
+    rows = conn.execute(
+        """
+        SELECT product_id, SUM(quantity) FROM product_sales
+        WHERE created_at >= datetime('now', ?)
+        GROUP BY product_id
+        """,
+        (f"-{days} days",),
+    )
+    return dict(rows.fetchall())
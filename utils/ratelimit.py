@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session
+
+CLEANUP_INTERVAL = 60  # seconds between sweeps of refilled rows in SqliteBucketStore
+
+
+def _wait_for(levels, rate):
+    """Seconds until every bucket has a token again, 0 if they all have one now."""
+    return max(((1 - tokens) / rate for tokens in levels if tokens < 1), default=0)
+
+
+class MemoryBucketStore:
+    """Token buckets kept in this process. Stand-in for a shared store."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, keys, limit, period, now):
+        """Take one token from every bucket in `keys`, or from none of them.
+
+        Returns 0 if allowed, else seconds to wait.
+        """
+        rate = limit / period
+        with self._lock:
+            levels = []
+            for key in keys:
+                tokens, last = self._buckets.get(key, (limit, now))
+                levels.append(min(limit, tokens + (now - last) * rate))
+            wait = _wait_for(levels, rate)
+            if wait:
+                return wait
+
+            for key, tokens in zip(keys, levels):
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            # least recently used buckets go first
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0
+
+
+class SqliteBucketStore:
+    """Token buckets in a SQLite file of their own, shared by every worker on the host."""
+
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self._local = threading.local()
+        self._next_cleanup = 0
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                full_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        # one connection per thread. Skipping fsync is only safe because the
+        # buckets are throwaway and this file holds nothing else, never
+        # point it at a database with real data in it
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_name, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def take(self, keys, limit, period, now):
+        rate = limit / period
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            levels = []
+            for key in keys:
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, last = row if row else (limit, now)
+                levels.append(min(limit, tokens + (now - last) * rate))
+            wait = _wait_for(levels, rate)
+            if not wait:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO rate_limits (key, tokens, updated_at, full_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    [(key, tokens - 1, now, now + (limit - tokens + 1) / rate)
+                     for key, tokens in zip(keys, levels)],
+                )
+            if now >= self._next_cleanup:
+                # a refilled bucket is the same as no row at all
+                conn.execute("DELETE FROM rate_limits WHERE full_at <= ?", (now,))
+                self._next_cleanup = now + CLEANUP_INTERVAL
+            conn.execute("COMMIT")
+            return wait
+        except sqlite3.OperationalError:
+            # store is busy or locked, fail open rather than block the request
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return 0
+
+
+_store = MemoryBucketStore()
+
+
+def set_store(store):
+    """Swap the bucket store used by every @rate_limit route."""
+    global _store
+    _store = store
+
+
+def _client_keys():
+    # remote_addr is the real client once ProxyFix has read X-Forwarded-For
+    keys = ["ip:" + (request.remote_addr or "unknown")]
+    user = session.get("user_id") or session.get("username")
+    if user:
+        keys.append("user:%s" % user)
+    return keys
+
+
+def rate_limit(limit, period=60, methods=None):
+    """Allow `limit` requests per `period` seconds per client, else 429.
+
+    Clients are tracked both by IP and by logged in user, with a separate
+    budget for each route. A request only spends tokens if every bucket
+    has one. `methods` restricts the limit to e.g. POST only.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if methods is None or request.method in methods:
+                keys = ["%s:%s" % (request.endpoint, key) for key in _client_keys()]
+                wait = _store.take(keys, limit, period, time.time())
+                if wait:
+                    return (
+                        "Too many requests. Please slow down.",
+                        429,
+                        {"Retry-After": str(int(wait) + 1)},
+                    )
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
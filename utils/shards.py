@@ -0,0 +1,121 @@
+import heapq
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+ORDER_COLUMNS = (
+    "id", "first_name", "last_name", "email", "address", "city", "state", "zipcode",
+    "total_amount", "created_at",
+)
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class OrderShards:
+    """Orders spread over several SQLite files by order id.
+
+    Ids are handed out by the order_outbox table in DB_NAME, so they are
+    unique across shards and an order's shard is simply `id % shard_count`.
+    Changing the number of shards needs the existing orders moved to match.
+
+    This spreads storage and reads. Checkout still writes through DB_NAME,
+    so it does not relieve contention on checkout's write lock.
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self._local = threading.local()
+
+    def _connection(self, shard):
+        # kept open per thread: closing the last connection to a WAL file
+        # checkpoints it, which would cost a sync on every order
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        if shard not in conns:
+            conns[shard] = connect(self.paths[shard])
+            conns[shard].execute("PRAGMA synchronous=NORMAL")
+        return conns[shard]
+
+    def create_schema(self):
+        for path in self.paths:
+            with connect(path) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS orders (
+                        id INTEGER PRIMARY KEY,
+                        first_name TEXT NOT NULL,
+                        last_name TEXT NOT NULL,
+                        email TEXT NOT NULL,
+                        address TEXT NOT NULL,
+                        city TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        zipcode TEXT NOT NULL,
+                        total_amount REAL NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)")
+            conn.close()
+
+    def shard_for(self, order_id):
+        return order_id % len(self.paths)
+
+    def store(self, orders):
+        """Write order dicts (with ids) to their shards. Orders already there are skipped."""
+        by_shard = {}
+        for order in orders:
+            by_shard.setdefault(self.shard_for(order["id"]), []).append(
+                [order.get(column) for column in ORDER_COLUMNS]
+            )
+        for shard, rows in by_shard.items():
+            conn = self._connection(shard)
+            try:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO orders (%s) VALUES (%s)"
+                    % (", ".join(ORDER_COLUMNS), ", ".join("?" * len(ORDER_COLUMNS))),
+                    rows,
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def get(self, order_id):
+        row = self._connection(self.shard_for(order_id)).execute(
+            "SELECT * FROM orders WHERE id = ?", (order_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def _fan_out(self, query, params=()):
+        def run(path):
+            conn = connect(path)
+            try:
+                return conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+
+        with ThreadPoolExecutor(max_workers=len(self.paths)) as pool:
+            return list(pool.map(run, self.paths))
+
+    def recent(self, limit=50):
+        """Newest orders across every shard."""
+        results = self._fan_out(
+            "SELECT * FROM orders ORDER BY created_at DESC, id DESC LIMIT ?", (limit,)
+        )
+        per_shard = [[dict(row) for row in rows] for rows in results]
+        merged = heapq.merge(*per_shard, key=lambda o: (o["created_at"], o["id"]), reverse=True)
+        return list(islice(merged, limit))
+
+    def totals(self):
+        """Order count and revenue summed over every shard."""
+        results = self._fan_out("SELECT COUNT(*), COALESCE(SUM(total_amount), 0) FROM orders")
+        return {
+            "count": sum(rows[0][0] for rows in results),
+            "revenue": sum(rows[0][1] for rows in results),
+        }
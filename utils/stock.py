@@ -0,0 +1,157 @@
+import threading
+import time
+import uuid
+from flask import session
+
+RESERVATION_TTL = 15 * 60  # seconds a cart holds its items
+DEFAULT_STOCK = 50
+MAX_RESERVE_PER_ITEM = 10  # most of one product a cart can hold, so a few accounts can't empty the shop
+
+
+class OutOfStock(Exception):
+    """Raised when an order asks for more than is left."""
+
+    def __init__(self, product_ids):
+        super().__init__("Not enough stock for products %s" % product_ids)
+        self.product_ids = product_ids
+
+
+def get_holder():
+    """Id of the current cart, used as the owner of its reservations."""
+    if "cart_id" not in session:
+        session["cart_id"] = uuid.uuid4().hex
+    return session["cart_id"]
+
+
+def _begin(conn):
+    # take the write lock up front so two checkouts can't both read then
+    # fail to upgrade, which is what causes SQLITE_BUSY storms
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+
+_AVAILABLE_FOR = """
+    (SELECT quantity FROM stock WHERE product_id = :product_id)
+    - (SELECT COALESCE(SUM(quantity), 0) FROM stock_reservations
+       WHERE product_id = :product_id AND holder != :holder AND expires_at > :now)
+"""
+
+
+def get_available(conn, product_id, holder=""):
+    row = conn.execute(
+        "SELECT " + _AVAILABLE_FOR,
+        {"product_id": product_id, "holder": holder, "now": time.time()},
+    ).fetchone()
+    return row[0] or 0
+
+
+def reserve_for_session(conn, product_id, quantity):
+    """Hold stock for a signed in user's cart, or just check it for a guest.
+
+    Guests can add to the cart without a cookie or an account, so letting
+    them hold stock would let a crawler empty the shop. Their items are
+    reserved when they reach checkout, which needs a login.
+    """
+    if "user_id" in session:
+        return reserve(conn, get_holder(), product_id, quantity)
+    if quantity > MAX_RESERVE_PER_ITEM:
+        return False
+    return quantity <= 0 or get_available(conn, product_id) >= quantity
+
+
+def reserve(conn, holder, product_id, quantity):
+    """Hold `quantity` of a product for `holder`.
+
+    Returns False if not enough is free or `quantity` is over MAX_RESERVE_PER_ITEM.
+    """
+    if quantity > MAX_RESERVE_PER_ITEM:
+        return False
+    now = time.time()
+    params = {"product_id": product_id, "holder": holder, "now": now}
+    try:
+        _begin(conn)
+        if quantity <= 0:
+            conn.execute(
+                "DELETE FROM stock_reservations WHERE holder = :holder AND product_id = :product_id",
+                params,
+            )
+        else:
+            available = conn.execute("SELECT " + _AVAILABLE_FOR, params).fetchone()[0]
+            if available is None or available < quantity:
+                conn.rollback()
+                return False
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO stock_reservations (holder, product_id, quantity, expires_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (holder, product_id, quantity, now + RESERVATION_TTL),
+            )
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def reserve_cart(conn, holder, cart):
+    """Refresh reservations for a whole cart. Returns ids that could not be held."""
+    return [pid for pid, qty in cart.items() if not reserve(conn, holder, int(pid), qty)]
+
+
+def release(conn, holder, product_id=None):
+    if product_id is None:
+        conn.execute("DELETE FROM stock_reservations WHERE holder = ?", (holder,))
+    else:
+        conn.execute(
+            "DELETE FROM stock_reservations WHERE holder = ? AND product_id = ?",
+            (holder, product_id),
+        )
+    conn.commit()
+
+
+def decrement_for_order(conn, holder, cart):
+    """Take the cart's items out of stock inside the caller's transaction.
+
+    Each row only decrements if enough is left after other carts'
+    reservations. If any product comes up short OutOfStock is raised and
+    the caller rolls back the whole order.
+    """
+    _begin(conn)
+    now = time.time()
+    short = []
+    for pid, qty in cart.items():
+        cur = conn.execute(
+            "UPDATE stock SET quantity = quantity - :quantity "
+            "WHERE product_id = :product_id AND :quantity <= " + _AVAILABLE_FOR,
+            {"product_id": int(pid), "quantity": qty, "holder": holder, "now": now},
+        )
+        if cur.rowcount != 1:
+            short.append(int(pid))
+    if short:
+        raise OutOfStock(short)
+    conn.execute("DELETE FROM stock_reservations WHERE holder = ?", (holder,))
+
+
+def sweep_expired(conn):
+    cur = conn.execute("DELETE FROM stock_reservations WHERE expires_at <= ?", (time.time(),))
+    conn.commit()
+    return cur.rowcount
+
+
+def start_sweeper(connect, interval=60):
+    """Delete abandoned reservations every `interval` seconds in a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            conn = connect()
+            try:
+                sweep_expired(conn)
+            except Exception:
+                pass  # locked or busy, try again next round
+            finally:
+                conn.close()
+
+    thread = threading.Thread(target=run, name="stock-sweeper", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,33 @@
+import os
+from flask import Response, current_app, get_flashed_messages, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+
+
+def setup_template_cache(app, cache_dir):
+    """Keep compiled templates on disk so every worker and restart reuses them."""
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+def precompile_templates(app):
+    """Compile every template up front instead of on its first request."""
+    env = app.jinja_env
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def stream_page(template_name, buffer_size=64, **context):
+    """Render a template as a streamed response so the top of the page goes out first.
+
+    `buffer_size` is how many template output pieces go in each chunk.
+    """
+    app = current_app._get_current_object()
+    # the session cookie is sent before the body renders, so pop the flashes
+    # now or they would show up again on the next page
+    get_flashed_messages()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(buffer_size)
+    return Response(stream_with_context(stream), mimetype="text/html")
@@ -1,19 +1,28 @@
 from flask import session
 from data.dummy_data import products
 
+def save_wishlist(wishlist):
+    session["wishlist"] = list(wishlist)
+    session["wishlist_count"] = len(wishlist)
+
+def get_wishlist_count():
+    if "wishlist_count" not in session:
+        return len(session.get("wishlist", []))
+    return session["wishlist_count"]
+
 def add_to_wishlist_helper(product_id):
     wishlist = session.get("wishlist", set())
     # Flask sessions don’t support sets directly, so we use a list
     wishlist = set(wishlist)  
     wishlist.add(str(product_id))
-    session["wishlist"] = list(wishlist)
+    save_wishlist(wishlist)
 
 
 def remove_from_wishlist_helper(product_id):
     wishlist = session.get("wishlist", set())
     wishlist = set(wishlist)
     wishlist.discard(str(product_id))
-    session["wishlist"] = list(wishlist)
+    save_wishlist(wishlist)
 
 
 def get_wishlist_items():